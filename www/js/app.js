@@ -3,67 +3,236 @@
 // ===========================================================
 
 // Gestión de datos local
+const CLAVE_DATOS = 'contabilidad_datos';
+const CLAVE_DATOS_CORRUPTOS = 'contabilidad_datos_corruptos';
+const FORMATO_FECHA = /^\d{4}-\d{2}-\d{2}$/;
+const RETARDO_GUARDADO_MS = 50;
+
+// 32 caracteres hexadecimales aleatorios, como uuid4().hex. Date.now()
+// repetía id si se creaban dos movimientos en el mismo milisegundo.
+function generarId() {
+    const bytes = crypto.getRandomValues(new Uint8Array(16));
+    let id = '';
+    for (const b of bytes) id += (b < 16 ? '0' : '') + b.toString(16);
+    return id;
+}
+
+// Todos los movimientos se crean con el mismo literal (mismas propiedades,
+// mismo orden) en lugar de mutar el objeto recibido.
+function crearMovimiento(id, { fecha, asunto, tipo, cantidad }) {
+    return { id, fecha, asunto, tipo, cantidad };
+}
+
+// Lo mismo que exige el formulario: saldos y filas dependen de ello
+function esMovimientoValido(m) {
+    return m !== null && typeof m === 'object' &&
+        typeof m.fecha === 'string' && FORMATO_FECHA.test(m.fecha) &&
+        typeof m.asunto === 'string' && m.asunto.trim() !== '' &&
+        (m.tipo === 'BANCO' || m.tipo === 'CASH') &&
+        typeof m.cantidad === 'number' && isFinite(m.cantidad);
+}
+
 class GestorDatos {
     constructor() {
-        this.datos = this.cargarDatos();
-        this.calcularSaldos();
+        this.datos = { movimientos: [], saldos: { banco: 0, cash: 0, total: 0 } };
+        this.sumas = { banco: 0, cash: 0 };
+        this.porId = new Map();
+        this.temporizadorGuardado = null;
+        this.textoCorrupto = null;
+        this.serializado = null;
+        this.recargarDatos();
     }
 
+    // Se persiste { movimientos }: los saldos se derivan de ellos al cargar,
+    // igual que hacían las versiones anteriores, que siguen pudiendo leerlo.
+    // Acepta también { movimientos, saldos } y una lista suelta.
     cargarDatos() {
-        const datosGuardados = localStorage.getItem('contabilidad_datos');
-        return datosGuardados ? JSON.parse(datosGuardados) : { movimientos: [], saldos: { banco: 0, cash: 0, total: 0 } };
+        const texto = localStorage.getItem(CLAVE_DATOS);
+        try {
+            const guardados = JSON.parse(texto || '[]');
+            const movimientos = Array.isArray(guardados) ? guardados : (guardados.movimientos || []);
+            return movimientos.map(m => crearMovimiento(m.id, m));
+        } catch {
+            // El próximo guardado pisará el valor dañado: se conserva una copia
+            // (y en memoria, por si no cabe) que se descarga al exportar
+            this.textoCorrupto = texto;
+            try {
+                localStorage.setItem(CLAVE_DATOS_CORRUPTOS, texto);
+                alert('⚠️ Los datos guardados estaban dañados y no se han podido cargar. ' +
+                    'Se ha guardado una copia: usa "Exportar Datos" para descargarla.');
+            } catch (error) {
+                console.error('No se pudo guardar la copia de los datos dañados:', error);
+                alert('❌ Los datos guardados estaban dañados y no se ha podido guardar una copia. ' +
+                    'Usa "Exportar Datos" ahora, antes de cerrar la app, para descargarla.');
+            }
+            return [];
+        }
     }
 
-    guardarDatos() {
-        localStorage.setItem('contabilidad_datos', JSON.stringify(this.datos));
+    // Contenido dañado encontrado al cargar, o null si no hay ninguno
+    copiaCorrupta() {
+        if (this.textoCorrupto !== null) return this.textoCorrupto;
+        return localStorage.getItem(CLAVE_DATOS_CORRUPTOS);
+    }
+
+    // Invalida la copia en memoria cuando otra ventana ha escrito los datos
+    recargarDatos() {
+        this.datos.movimientos = this.cargarDatos();
+        this.serializado = null;
+        if (this.indexarMovimientos()) this.guardarDatos();
         this.calcularSaldos();
         return this.datos;
     }
 
+    // localStorage es síncrono: la escritura se aplaza para no bloquear el
+    // repintado de la tabla, que ya puede hacerse con this.datos. Los cambios
+    // que llegan mientras hay una escritura programada se agrupan en ella.
+    guardarDatos() {
+        if (this.temporizadorGuardado === null) {
+            this.temporizadorGuardado = setTimeout(() => this.persistirDatos(), RETARDO_GUARDADO_MS);
+        }
+        return this.datos;
+    }
+
+    persistirDatos() {
+        clearTimeout(this.temporizadorGuardado);
+        this.temporizadorGuardado = null;
+        this.serializado = JSON.stringify(this.datos.movimientos);
+        // setItem sustituye el valor entero o lanza sin tocar el anterior
+        try {
+            localStorage.setItem(CLAVE_DATOS, `{"movimientos":${this.serializado}}`);
+        } catch (error) {
+            console.error('Error al guardar:', error);
+            alert('❌ No se pudieron guardar los datos (¿almacenamiento lleno?). Exporta una copia.');
+        }
+    }
+
+    guardarPendiente() {
+        if (this.temporizadorGuardado !== null) this.persistirDatos();
+    }
+
+    // Cancela la escritura programada; devuelve true si había una
+    descartarPendiente() {
+        if (this.temporizadorGuardado === null) return false;
+        clearTimeout(this.temporizadorGuardado);
+        this.temporizadorGuardado = null;
+        return true;
+    }
+
+    // Cada movimiento necesita un id de texto único para poder modificarlo y
+    // eliminarlo desde su fila. Los datos guardados o importados pueden traer
+    // id ausentes, numéricos o repetidos (los Date.now() antiguos); esos
+    // reciben uno válido. Devuelve true si ha cambiado algún id.
+    indexarMovimientos() {
+        this.porId = new Map();
+        let cambiados = false;
+        for (const mov of this.datos.movimientos) {
+            if (mov.id == null || this.porId.has(String(mov.id))) {
+                mov.id = generarId();
+                cambiados = true;
+            } else if (typeof mov.id !== 'string') {
+                mov.id = String(mov.id);
+                cambiados = true;
+            }
+            this.porId.set(mov.id, mov);
+        }
+        return cambiados;
+    }
+
+    buscarMovimiento(id) {
+        return this.porId.get(id);
+    }
+
+    // Recalcula los saldos desde cero; solo al cargar o importar datos.
+    // Altas, bajas y modificaciones los actualizan con sumarSaldo().
     calcularSaldos() {
-        const saldoBanco = this.datos.movimientos.filter(m => m.tipo === 'BANCO').reduce((sum, mov) => sum + mov.cantidad, 0);
-        const saldoCash = this.datos.movimientos.filter(m => m.tipo === 'CASH').reduce((sum, mov) => sum + mov.cantidad, 0);
+        // Una sola pasada para ambos saldos
+        let saldoBanco = 0, saldoCash = 0;
+        for (const mov of this.datos.movimientos) {
+            if (mov.tipo === 'BANCO') saldoBanco += mov.cantidad;
+            else if (mov.tipo === 'CASH') saldoCash += mov.cantidad;
+        }
+        this.sumas = { banco: saldoBanco, cash: saldoCash };
+        this.publicarSaldos();
+    }
+
+    sumarSaldo(mov, signo) {
+        if (mov.tipo === 'BANCO') this.sumas.banco += signo * mov.cantidad;
+        else if (mov.tipo === 'CASH') this.sumas.cash += signo * mov.cantidad;
+        this.publicarSaldos();
+    }
+
+    publicarSaldos() {
+        const { banco, cash } = this.sumas;
         this.datos.saldos = {
-            banco: Math.round(saldoBanco * 100) / 100,
-            cash: Math.round(saldoCash * 100) / 100,
-            total: Math.round((saldoBanco + saldoCash) * 100) / 100
+            banco: Math.round(banco * 100) / 100,
+            cash: Math.round(cash * 100) / 100,
+            total: Math.round((banco + cash) * 100) / 100
         };
     }
 
-    agregarMovimiento(movimiento) {
-        movimiento.id = Date.now().toString();
+    agregarMovimiento(datosMovimiento) {
+        const movimiento = crearMovimiento(generarId(), datosMovimiento);
         movimiento.fecha = movimiento.fecha || new Date().toISOString().split('T')[0];
         this.datos.movimientos.push(movimiento);
+        this.porId.set(movimiento.id, movimiento);
+        this.sumarSaldo(movimiento, 1);
         return this.guardarDatos();
     }
 
     eliminarMovimiento(id) {
-        this.datos.movimientos = this.datos.movimientos.filter(m => m.id !== id);
-        return this.guardarDatos();
+        const mov = this.porId.get(id);
+        if (mov) {
+            this.sumarSaldo(mov, -1);
+            this.datos.movimientos.splice(this.datos.movimientos.indexOf(mov), 1);
+            this.porId.delete(id);
+            return this.guardarDatos();
+        }
+        return this.datos;
     }
 
-    modificarMovimiento(id, movimientoActualizado) {
-        const index = this.datos.movimientos.findIndex(m => m.id === id);
-        if (index !== -1) {
-            movimientoActualizado.id = id;
+    modificarMovimiento(id, datosMovimiento) {
+        const anterior = this.porId.get(id);
+        if (anterior) {
+            const index = this.datos.movimientos.indexOf(anterior);
+            const movimientoActualizado = crearMovimiento(id, datosMovimiento);
+            this.porId.set(id, movimientoActualizado);
+            this.sumarSaldo(anterior, -1);
+            this.sumarSaldo(movimientoActualizado, 1);
             this.datos.movimientos[index] = movimientoActualizado;
             return this.guardarDatos();
         }
         return this.datos;
     }
 
+    // Se valida en memoria antes de tocar los datos actuales: un archivo
+    // no válido no los modifica. Acepta { movimientos, saldos } o una lista.
+    // Los id ausentes, numéricos o repetidos se corrigen al indexar.
     importarDatos(jsonData) {
+        let importados;
         try {
-            this.datos = JSON.parse(jsonData);
-            this.guardarDatos();
-            return true;
+            importados = JSON.parse(jsonData);
         } catch {
             return false;
         }
+        const movimientos = Array.isArray(importados) ? importados : importados && importados.movimientos;
+        if (!Array.isArray(movimientos) || !movimientos.every(esMovimientoValido)) {
+            return false;
+        }
+        this.datos.movimientos = movimientos.map(m => crearMovimiento(m.id, m));
+        this.indexarMovimientos();
+        this.calcularSaldos();
+        this.persistirDatos();
+        return true;
     }
 
-    exportarDatos() {
-        return JSON.stringify(this.datos, null, 2);
+    // Reutiliza el JSON de la última escritura en lugar de volver a
+    // serializar todos los movimientos. Con legible se indenta para mostrarlo.
+    exportarDatos({ legible = false } = {}) {
+        if (legible) return JSON.stringify(this.datos, null, 2);
+        this.guardarPendiente();
+        if (this.serializado === null) this.serializado = JSON.stringify(this.datos.movimientos);
+        return `{"movimientos":${this.serializado},"saldos":${JSON.stringify(this.datos.saldos)}}`;
     }
 }
 
@@ -71,7 +240,11 @@ class GestorDatos {
 // Variables globales
 // ===========================================================
 let editandoMovimientoId = null;
-let todosLosMovimientos = [];
+// Fila ya construida de cada movimiento. Al modificar, importar o recargar
+// se crean objetos nuevos, así que sus filas antiguas dejan de usarse solas.
+const filasPorMovimiento = new WeakMap();
+// La plantilla está en index.html antes de este script
+const plantillaFila = document.getElementById('plantillaFila').content.firstElementChild;
 const gestorDatos = new GestorDatos();
 
 // ===========================================================
@@ -79,41 +252,76 @@ const gestorDatos = new GestorDatos();
 // ===========================================================
 document.addEventListener('DOMContentLoaded', () => {
     const datos = gestorDatos.datos;
-    todosLosMovimientos = datos.movimientos;
+    document.getElementById('tablaMovimientos').addEventListener('click', manejarAccionFila);
     actualizarTablaYDom(datos);
 });
 
+// Escribe lo pendiente antes de que la app pase a segundo plano o se cierre
+document.addEventListener('visibilitychange', () => {
+    if (document.visibilityState === 'hidden') gestorDatos.guardarPendiente();
+});
+document.addEventListener('pause', () => gestorDatos.guardarPendiente());
+window.addEventListener('pagehide', () => gestorDatos.guardarPendiente());
+
+window.addEventListener('storage', (evento) => {
+    if (evento.key !== CLAVE_DATOS) return;
+    // Escribir lo pendiente pisaría los datos de la otra ventana
+    if (gestorDatos.descartarPendiente()) {
+        alert('⚠️ Los datos se han modificado en otra ventana; tu último cambio no se ha guardado.');
+    }
+    actualizarTablaYDom(gestorDatos.recargarDatos());
+});
+
 // ===========================================================
 // CRUD y DOM
 // ===========================================================
 function actualizarTablaYDom(datos) {
-    const tablaBody = document.getElementById('tablaMovimientos');
-    tablaBody.innerHTML = '';
+    // Las filas se reutilizan entre repintados (y filtros); solo se crean
+    // las de movimientos nuevos. Todas se insertan de una vez.
+    const fragmento = document.createDocumentFragment();
 
     datos.movimientos.forEach(mov => {
-        const fila = tablaBody.insertRow();
-        fila.id = `movimiento-${mov.id}`;
-        fila.insertCell().textContent = mov.fecha;
-        fila.insertCell().textContent = mov.asunto;
-        fila.insertCell().textContent = mov.tipo;
-        fila.insertCell().textContent = parseFloat(mov.cantidad).toFixed(2) + ' €';
-
-        const cellAcciones = fila.insertCell();
-        cellAcciones.innerHTML = `
-            <div class="acciones-botones">
-                <button class="btn-modificar" onclick="iniciarModificacion('${mov.id}')">✏️</button>
-                <button class="btn-eliminar" onclick="eliminarMovimiento('${mov.id}')">🗑️</button>
-            </div>
-        `;
+        let fila = filasPorMovimiento.get(mov);
+        if (!fila) {
+            fila = crearFila(mov);
+            filasPorMovimiento.set(mov, fila);
+        }
+        fragmento.appendChild(fila);
     });
 
+    // Sin replaceChildren: no existe en los WebView antiguos (minSdk 22)
+    const tablaBody = document.getElementById('tablaMovimientos');
+    tablaBody.textContent = '';
+    tablaBody.appendChild(fragmento);
+
     document.getElementById('saldoBanco').textContent = datos.saldos.banco.toFixed(2);
     document.getElementById('saldoCash').textContent = datos.saldos.cash.toFixed(2);
     document.getElementById('saldoTotal').textContent = datos.saldos.total.toFixed(2);
 
     editandoMovimientoId = null;
     document.querySelector('button[onclick="guardarMovimiento()"]').textContent = 'OK / GUARDAR';
-    todosLosMovimientos = datos.movimientos;
+}
+
+function crearFila(mov) {
+    const fila = plantillaFila.cloneNode(true);
+    fila.id = `movimiento-${mov.id}`;
+    fila.dataset.id = mov.id;
+    const celdas = fila.cells;
+    celdas[0].textContent = mov.fecha;
+    celdas[1].textContent = mov.asunto;
+    celdas[2].textContent = mov.tipo;
+    celdas[3].textContent = parseFloat(mov.cantidad).toFixed(2) + ' €';
+    return fila;
+}
+
+// Los clics de los botones de cada fila se atienden con un único
+// listener en la tabla; el id del movimiento está en la fila.
+function manejarAccionFila(evento) {
+    const boton = evento.target.closest('button[data-accion]');
+    if (!boton) return;
+    const id = boton.closest('tr').dataset.id;
+    if (boton.dataset.accion === 'modificar') iniciarModificacion(id);
+    else if (boton.dataset.accion === 'eliminar') eliminarMovimiento(id);
 }
 
 // ===========================================================
@@ -130,6 +338,11 @@ function guardarMovimiento() {
         return;
     }
 
+    if (!FORMATO_FECHA.test(fecha)) {
+        alert("La fecha debe tener el formato AAAA-MM-DD.");
+        return;
+    }
+
     // Convierte la cantidad a número, reemplaza coma y acepta negativo
     const cantidad = Number(cantidadStr.replace(',', '.'));
     if (!isFinite(cantidad)) {
@@ -162,7 +375,7 @@ function eliminarMovimiento(id) {
 }
 
 function iniciarModificacion(id) {
-    const mov = todosLosMovimientos.find(m => m.id === id);
+    const mov = gestorDatos.buscarMovimiento(id);
     if (!mov) return;
 
     document.getElementById('inputFecha').value = mov.fecha;
@@ -185,12 +398,17 @@ function aplicarFiltros() {
     const cantidadMax = document.getElementById('filtroCantidadMax').value;
     const tipo = document.getElementById('filtroTipo').value;
 
-    let movs = [...todosLosMovimientos];
-    if (fechaDesde) movs = movs.filter(m => m.fecha >= fechaDesde);
-    if (fechaHasta) movs = movs.filter(m => m.fecha <= fechaHasta);
-    if (cantidadMin) movs = movs.filter(m => m.cantidad >= parseFloat(cantidadMin));
-    if (cantidadMax) movs = movs.filter(m => m.cantidad <= parseFloat(cantidadMax));
-    if (tipo) movs = movs.filter(m => m.tipo === tipo);
+    // Una sola pasada sobre los movimientos del gestor, sin copias
+    // intermedias y con los límites numéricos convertidos una vez
+    const min = parseFloat(cantidadMin);
+    const max = parseFloat(cantidadMax);
+    const movs = gestorDatos.datos.movimientos.filter(m =>
+        (!fechaDesde || m.fecha >= fechaDesde) &&
+        (!fechaHasta || m.fecha <= fechaHasta) &&
+        (!cantidadMin || m.cantidad >= min) &&
+        (!cantidadMax || m.cantidad <= max) &&
+        (!tipo || m.tipo === tipo)
+    );
 
     actualizarTablaYDom({ movimientos: movs, saldos: gestorDatos.datos.saldos });
 }
@@ -209,28 +427,17 @@ function limpiarFiltros() {
 // ===========================================================
 function exportarDatos() {
     try {
-        const datos = gestorDatos.exportarDatos();
-        const nombreArchivo = 'contabilidad_data_' + new Date().toISOString().split('T')[0] + '.json';
-        
-        // Método principal: Blob + URL.createObjectURL
-        const blob = new Blob([datos], { type: 'application/json;charset=utf-8' });
-        const url = URL.createObjectURL(blob);
-        
-        const enlace = document.createElement('a');
-        enlace.href = url;
-        enlace.download = nombreArchivo;
-        enlace.style.display = 'none';
-        
-        document.body.appendChild(enlace);
-        enlace.click();
-        document.body.removeChild(enlace);
-        
-        // Liberar memoria después de un tiempo
-        setTimeout(() => {
-            URL.revokeObjectURL(url);
-        }, 5000);
-        
-        alert('✅ Datos exportados. Revisa tu carpeta de "Descargas".');
+        const fecha = new Date().toISOString().split('T')[0];
+        descargarArchivo(gestorDatos.exportarDatos(), 'contabilidad_data_' + fecha + '.json', 'application/json');
+
+        // Si al cargar había datos dañados, se descargan también tal cual
+        const copia = gestorDatos.copiaCorrupta();
+        if (copia !== null) {
+            descargarArchivo(copia, 'contabilidad_datos_danados_' + fecha + '.txt', 'text/plain');
+            alert('✅ Datos exportados, junto con la copia de los datos dañados. Revisa tu carpeta de "Descargas".');
+        } else {
+            alert('✅ Datos exportados. Revisa tu carpeta de "Descargas".');
+        }
         
     } catch (error) {
         console.error('Error en exportación:', error);
@@ -238,8 +445,28 @@ function exportarDatos() {
     }
 }
 
+function descargarArchivo(contenido, nombreArchivo, tipo) {
+    // Método principal: Blob + URL.createObjectURL
+    const blob = new Blob([contenido], { type: tipo + ';charset=utf-8' });
+    const url = URL.createObjectURL(blob);
+    
+    const enlace = document.createElement('a');
+    enlace.href = url;
+    enlace.download = nombreArchivo;
+    enlace.style.display = 'none';
+    
+    document.body.appendChild(enlace);
+    enlace.click();
+    document.body.removeChild(enlace);
+    
+    // Liberar memoria después de un tiempo
+    setTimeout(() => {
+        URL.revokeObjectURL(url);
+    }, 5000);
+}
+
 function exportarDatosAlternativo() {
-    const datos = gestorDatos.exportarDatos();
+    const datos = gestorDatos.exportarDatos({ legible: true });
     const nombreArchivo = 'contabilidad_data_' + new Date().toISOString().split('T')[0] + '.json';
     
     // Método alternativo: nueva ventana para copiar/pegar